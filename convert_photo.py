@@ -1,7 +1,45 @@
 #!/usr/bin/env python3
-import argparse, os, sys
+import argparse, functools, io, os, queue, re, struct, sys, threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image, ImageColor
+
+import numpy as np
+from PIL import Image, ImageColor, UnidentifiedImageError
+
+try:
+    import cv2
+except ImportError:  # OpenCV es opcional; sin él se usa Pillow para redimensionar
+    cv2 = None
+else:
+    # Un hilo por proceso: el paralelismo ya lo dan los --jobs procesos
+    cv2.setNumThreads(1)
+
+try:
+    import pyvips
+except (ImportError, OSError):  # pyvips/libvips opcionales; solo con --engine vips
+    pyvips = None
+
+try:
+    from numba import njit
+except ImportError:  # Numba es opcional; sin él la composición alpha usa NumPy
+    njit = None
+
+try:
+    import deflate  # bindings de libdeflate
+except ImportError:  # opcional; sin él los PNG se codifican con Pillow/zlib
+    deflate = None
+
+try:
+    from nvidia.dali import fn, pipeline_def, types
+except ImportError:  # NVIDIA DALI es opcional; solo se usa con --device cuda
+    pipeline_def = None
+
+try:
+    from turbojpeg import TurboJPEG, TJFLAG_PROGRESSIVE, TJPF_RGB, TJSAMP_420
+    _tj = TurboJPEG()
+except (ImportError, OSError, RuntimeError):  # PyTurboJPEG/libturbojpeg opcionales
+    _tj = None
 
 """Photo converter and squaring utility.
 
@@ -33,6 +71,9 @@ Use cases (kept from the original script, rewritten in English):
 #   -ef webp,jpg --exclude_filenames "preview,tmp" -w 6000 -f png -q 9 -c ffffff
 """
 
+# Extensiones de entrada que Pillow suele abrir
+ALLOWED_EXTS = frozenset({"jpg", "jpeg", "png", "tif", "tiff", "bmp", "webp", "heic"})
+
 def parse_args():
     """Create and parse CLI arguments.
 
@@ -70,11 +111,31 @@ def parse_args():
     # - Output quality scale (1–10). For JPG maps to Pillow quality, for PNG maps to compress level
     p.add_argument("-q", "--output_quality", type=int, default=10,
                    help="Calidad 1–10 (solo JPG/PNG). Por defecto 10 (máxima).")
+    # - Resize backend. cv2 is faster; pil uses Pillow (LANCZOS, box filter for integer downscales);
+    #   vips runs decode+resize+pad+encode as one streamed libvips pipeline
+    p.add_argument("-e", "--engine", choices=["pil", "cv2", "vips"], default="cv2" if cv2 is not None else "pil",
+                   help="Motor de redimensionado: pil, cv2 o vips (por defecto cv2 si está instalado).")
+    # - Device for JPEG inputs. cuda decodes (nvJPEG), resizes and pads on the GPU via NVIDIA DALI
+    p.add_argument("--device", choices=["cpu", "cuda"], default="cpu",
+                   help="Dispositivo para entradas JPEG: cpu o cuda (requiere NVIDIA DALI).")
+    # - Number of worker processes used to convert images in parallel
+    p.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                   help="Procesos en paralelo. Por defecto el número de CPUs.")
     return p.parse_args()
 
+# Tablas 1–10 precalculadas para quality_maps (índice 0 sin uso)
+# JPG: mapear 1–10 a 30–95 aprox.
+_JPG_Q = (None,) + tuple(int(30 + (q - 1) * (65/9)) for q in range(1, 11))
+# PNG: Pillow usa compress_level 0–9 (menor = más grande, mayor = más comprimido).
+# q10=10 => comp=9 (máxima), q10=1 => comp=0.
+_PNG_C = (None,) + tuple(int(round((q - 1) * (9/9))) for q in range(1, 11))
+_QUALITY_TABLES = {"jpg": _JPG_Q, "png": _PNG_C}
+
 def quality_maps(fmt, q10):
     """Map a 1–10 quality scale to Pillow encoder parameters.
 
+    Values come from the precomputed _JPG_Q / _PNG_C tables.
+
     Args:
         fmt (str): Output format, either "jpg" or "png".
         q10 (int): Quality scale from 1 (lowest) to 10 (highest).
@@ -83,35 +144,64 @@ def quality_maps(fmt, q10):
         int | None: For JPG, a Pillow JPEG quality (approx. 30–95). For PNG,
         a compress_level (0–9). Returns None for unsupported formats.
     """
-    q10 = max(1, min(10, q10))
-    if fmt == "jpg":
-        # Mapear 1–10 a 30–95 aprox.
-        return int(30 + (q10 - 1) * (65/9))
-    if fmt == "png":
-        # Pillow usa compress_level 0–9 (menor = más grande, mayor = más comprimido).
-        # Aproximamos: q10=10 => comp=9 (máxima), q10=1 => comp=0.
-        return 9 - int(round((q10 - 1) * (9/9)))
-    return None
-
-def should_skip(file: Path, exclude_exts, exclude_substrings):
+    table = _QUALITY_TABLES.get(fmt)
+    return None if table is None else table[max(1, min(10, q10))]
+
+def should_skip(name_lower: str, ext: str, exclude_exts, exclude_re):
     """Check if a file should be skipped based on extension or name substrings.
 
     Args:
-        file (Path): Candidate file path.
-        exclude_exts (list[str]): Extensions (lowercase, without dot) to skip.
-        exclude_substrings (list[str]): Substrings; if present in filename (lowercase), skip.
+        name_lower (str): Candidate file name, already lowercased.
+        ext (str): Candidate extension (lowercase, without dot).
+        exclude_exts (frozenset[str]): Extensions (lowercase, without dot) to skip.
+        exclude_re (re.Pattern | None): Alternation of the excluded substrings
+            (see build_exclude_re); None when there are none.
 
     Returns:
         bool: True if the file should be skipped.
     """
-    name_lower = file.name.lower()
-    ext = file.suffix.lower().lstrip(".")
-    if ext in exclude_exts:
-        return True
-    for sub in exclude_substrings:
-        if sub and sub in name_lower:
-            return True
-    return False
+    return ext in exclude_exts or (exclude_re is not None and exclude_re.search(name_lower) is not None)
+
+def build_exclude_re(exclude_substrings):
+    """Compile the excluded filename substrings into a single regex.
+
+    Args:
+        exclude_substrings (list[str]): Lowercase substrings to exclude.
+
+    Returns:
+        re.Pattern | None: Pattern matching any of the substrings, or None if
+        the list is empty.
+    """
+    subs = [s for s in exclude_substrings if s]
+    return re.compile("|".join(map(re.escape, subs))) if subs else None
+
+def _scan(root: str, recursive: bool = True):
+    """Yield file entries under root using os.scandir.
+
+    DirEntry objects cache the type information returned by the directory
+    listing, so no extra stat() call is needed per file. Symlinks are skipped.
+    Subdirectories that cannot be listed (e.g. PermissionError) are reported
+    on stderr and skipped; an unreadable root still raises.
+
+    Args:
+        root (str): Directory to scan.
+        recursive (bool): Descend into subdirectories when True.
+
+    Yields:
+        os.DirEntry: One entry per regular file.
+    """
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_symlink():
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    try:
+                        yield from _scan(entry.path, recursive)
+                    except OSError as e:
+                        print(f"[WARN] No se pudo leer la carpeta {entry.path}: {e}", file=sys.stderr)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
 
 def ensure_dir(path: Path):
     """Ensure a directory exists (mkdir -p equivalent).
@@ -121,169 +211,765 @@ def ensure_dir(path: Path):
     """
     path.mkdir(parents=True, exist_ok=True)
 
-def pad_to_square(img: Image.Image, target: int, bg_rgb):
+def fit_geometry(w: int, h: int, target: int):
+    """Compute resized size and centering offset for a source of size (w, h).
+
+    Args:
+        w (int): Source width in pixels.
+        h (int): Source height in pixels.
+        target (int): Target side length in pixels for the square canvas.
+
+    Returns:
+        tuple[int, int, int, int]: (new_w, new_h, x, y) where (x, y) is the
+        top-left paste offset on the square canvas.
+    """
+    scale = target / float(max(w, h))
+    # Al menos 1 px por lado (p. ej. 3000x1 no debe dar una altura 0)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    return new_w, new_h, (target - new_w)//2, (target - new_h)//2
+
+def resize_to_array(img: Image.Image, size, engine: str = "pil"):
+    """Resize an image and return its pixels as a NumPy array.
+
+    Same-size inputs are returned without resampling. With engine "pil",
+    exact integer downscales use Image.reduce (a box filter, several times
+    faster than LANCZOS and slightly softer, without LANCZOS ringing); any
+    other size goes through LANCZOS with reducing_gap=3.0, so large downscales
+    are first box-reduced by an integer factor. Installing Pillow-SIMD instead
+    of Pillow speeds this path up with no code change. With engine "cv2", downscales use
+    INTER_AREA and upscales INTER_LANCZOS4.
+    Images with alpha are resized premultiplied, as Pillow does, so that fully
+    transparent pixels do not bleed their color into the edges.
+
+    Args:
+        img (PIL.Image.Image): Input image in RGB, RGBA, LA or another mode
+            convertible to RGB.
+        size (tuple[int, int]): Output (width, height).
+        engine (str): "pil" (LANCZOS) or "cv2".
+
+    Returns:
+        numpy.ndarray: uint8 array of shape (h, w, 3) or (h, w, 4) for alpha.
+    """
+    if img.mode == "LA":
+        img = img.convert("RGBA")
+    elif img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+
+    # Mismo tamaño: no hace falta redimensionar
+    if size == img.size:
+        return np.asarray(img)
+
+    has_alpha = img.mode == "RGBA"
+    if engine != "cv2":
+        # Reducción por factor entero: filtro de caja (reduce), más rápido que LANCZOS
+        k, rem = divmod(img.width, size[0])
+        if k > 1 and rem == 0 and img.height == size[1] * k:
+            if has_alpha:
+                return np.asarray(img.convert("RGBa").reduce(k).convert("RGBA"))
+            return np.asarray(img.reduce(k))
+        # reducing_gap: reducción de caja previa en reducciones grandes, luego LANCZOS
+        return np.asarray(img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0))
+
+    if has_alpha:
+        img = img.convert("RGBa")
+    interp = cv2.INTER_AREA if size[0] < img.width else cv2.INTER_LANCZOS4
+    arr = cv2.resize(np.asarray(img), size, interpolation=interp)
+    if has_alpha:
+        arr = np.asarray(Image.fromarray(arr, "RGBa").convert("RGBA"))
+    return arr
+
+def _composite_alpha_numpy(region, src):
+    """Blend RGBA src over the RGB region in place (vectorized NumPy)."""
+    alpha = src[..., 3:4].astype(np.uint16)
+    region[:] = (src[..., :3] * alpha + region * (255 - alpha) + 127) // 255
+
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _composite_alpha_numba(region, src):
+        """Blend RGBA src over the RGB region in place (compiled loop).
+
+        Opaque pixels are copied and transparent ones skipped; only partially
+        transparent pixels pay for the blend. Same rounding as the NumPy path.
+        """
+        h, w = src.shape[0], src.shape[1]
+        for i in range(h):
+            for j in range(w):
+                a = np.int32(src[i, j, 3])
+                if a == 255:
+                    region[i, j, 0] = src[i, j, 0]
+                    region[i, j, 1] = src[i, j, 1]
+                    region[i, j, 2] = src[i, j, 2]
+                elif a != 0:
+                    for ch in range(3):
+                        region[i, j, ch] = (np.int32(src[i, j, ch]) * a
+                                            + np.int32(region[i, j, ch]) * (255 - a) + 127) // 255
+
+    composite_alpha = _composite_alpha_numba
+else:
+    composite_alpha = _composite_alpha_numpy
+
+class SquarePadder:
+    """Reusable square canvas for padding a batch of images.
+
+    The canvas is allocated and filled with the background color once. For
+    each image only the rectangle written by the previous call is reset to
+    the background (and not even that when an opaque image fully covers it),
+    so per-image memory traffic scales with the resized image instead of the
+    full target x target canvas. The canvas is returned as a NumPy array
+    without copying; the encoders consume it directly.
+
+    Args:
+        target (int): Target side length in pixels for the square canvas.
+        bg_rgb (tuple[int, int, int]): Background RGB color for the canvas.
+    """
+
+    def __init__(self, target: int, bg_rgb):
+        self.target = target
+        self.bg_rgb = tuple(bg_rgb)
+        self._canvas = np.empty((target, target, 3), dtype=np.uint8)
+        self._canvas[:] = self.bg_rgb
+        self._last_box = None
+
+    def __call__(self, img: Image.Image, engine: str = "pil"):
+        """Resize img so its long side equals target and center it on the canvas.
+
+        Args:
+            img (PIL.Image.Image): Input image.
+            engine (str): Resize backend, "pil" or "cv2" (see resize_to_array).
+
+        Returns:
+            numpy.ndarray: The (target, target, 3) uint8 RGB canvas. This is
+            the internal buffer, valid only until the next call.
+        """
+        # Escalar manteniendo AR para que el lado LARGO == target
+        new_w, new_h, x, y = fit_geometry(*img.size, self.target)
+        src = resize_to_array(img, (new_w, new_h), engine)
+
+        # Restaurar el fondo solo donde se pegó la imagen anterior, salvo que
+        # la nueva imagen (opaca) la cubra por completo
+        box = (y, y + new_h, x, x + new_w)
+        if self._last_box is not None:
+            y0, y1, x0, x1 = self._last_box
+            covered = y <= y0 and y1 <= box[1] and x <= x0 and x1 <= box[3]
+            if src.shape[2] == 4 or not covered:
+                self._canvas[y0:y1, x0:x1] = self.bg_rgb
+        self._last_box = box
+
+        region = self._canvas[y:y + new_h, x:x + new_w]
+        if src.shape[2] == 4:
+            # Si tiene alpha, aplanamos contra el color de fondo (aritmética entera)
+            composite_alpha(region, src)
+        else:
+            region[:] = src
+        return self._canvas
+
+@functools.lru_cache(maxsize=1)
+def get_padder(target: int, bg_rgb):
+    """Return the SquarePadder for (target, bg_rgb), one per worker process.
+
+    Args:
+        target (int): Target side length in pixels for the square canvas.
+        bg_rgb (tuple[int, int, int]): Background RGB color for the canvas.
+
+    Returns:
+        SquarePadder: Cached padder; the canvas is reused across calls.
+    """
+    return SquarePadder(target, bg_rgb)
+
+def pad_to_square(img: Image.Image, target: int, bg_rgb, engine: str = "pil"):
     """Resize an image to fit into a square canvas of size target x target.
 
     The image is resized preserving aspect ratio so that the long side equals
     target, then centered on a new RGB canvas of size (target, target) with
-    the provided background color.
+    the provided background color. Uses a fresh SquarePadder; batch callers
+    should go through get_padder to reuse the canvas.
 
     Args:
         img (PIL.Image.Image): Input image.
         target (int): Target side length in pixels for the square canvas.
         bg_rgb (tuple[int, int, int]): Background RGB color for the canvas.
+        engine (str): Resize backend, "pil" or "cv2" (see resize_to_array).
 
     Returns:
         PIL.Image.Image: The squared image on an RGB canvas.
     """
-    # Escalar manteniendo AR para que el lado LARGO == target
-    w, h = img.size
-    scale = target / float(max(w, h))
-    new_w, new_h = int(round(w * scale)), int(round(h * scale))
-    img_resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-
-    # Crear lienzo cuadrado y centrar
-    if img_resized.mode in ("RGBA", "LA"):
-        # Si tiene alpha, aplanamos contra el color de fondo
-        base = Image.new("RGB", (target, target), bg_rgb)
-        base.paste(img_resized, ((target - new_w)//2, (target - new_h)//2), img_resized)
+    return Image.fromarray(SquarePadder(target, bg_rgb)(img, engine), "RGB")
+
+def encode_jpeg_turbo(canvas, quality: int):
+    """Encode an RGB canvas as progressive JPEG with libjpeg-turbo.
+
+    Args:
+        canvas (numpy.ndarray): (h, w, 3) uint8 RGB pixels.
+        quality (int): JPEG quality (1–100).
+
+    Returns:
+        bytes: The encoded JPEG file.
+    """
+    return _tj.encode(canvas, quality=quality, pixel_format=TJPF_RGB,
+                      jpeg_subsample=TJSAMP_420, flags=TJFLAG_PROGRESSIVE)
+
+def _png_chunk(tag: bytes, data: bytes):
+    """Serialize one PNG chunk (length, tag, data, CRC32)."""
+    crc = deflate.crc32(data, deflate.crc32(tag))
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+def encode_png_deflate(canvas, comp: int):
+    """Encode an RGB canvas as PNG, compressing with libdeflate.
+
+    Rows use PNG filter type 2 (Up), computed with one vectorized subtraction;
+    on the padded canvases this compresses about as well as Pillow's adaptive
+    filtering. compress_level 0–9 is mapped onto libdeflate levels 1–10:
+    level 0 would store the data uncompressed (Pillow's optimize=True never
+    did), and levels 11–12 are several times slower for ~0.1% smaller files.
+
+    Args:
+        canvas (numpy.ndarray): (h, w, 3) uint8 RGB pixels.
+        comp (int): Pillow-style compress_level (0–9).
+
+    Returns:
+        bytes: The encoded PNG file.
+    """
+    h, w = canvas.shape[:2]
+    flat = canvas.reshape(h, w * 3)
+    rows = np.empty((h, 1 + w * 3), dtype=np.uint8)
+    rows[:, 0] = 2
+    rows[0, 1:] = flat[0]
+    np.subtract(flat[1:], flat[:-1], out=rows[1:, 1:])
+
+    level = comp + 1
+    ihdr = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)  # 8 bits, RGB
+    idat = bytes(deflate.zlib_compress(rows.tobytes(), level))
+    return (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", ihdr)
+            + _png_chunk(b"IDAT", idat) + _png_chunk(b"IEND", b""))
+
+def encode_canvas(canvas, out_fmt: str, q10: int):
+    """Encode a squared RGB canvas with mapped quality/compression.
+
+    JPG goes through libjpeg-turbo when PyTurboJPEG is available, PNG through
+    libdeflate when the deflate package is available; otherwise the array is
+    wrapped in a PIL image and saved with Pillow.
+
+    Args:
+        canvas (numpy.ndarray): (h, w, 3) uint8 RGB pixels.
+        out_fmt (str): Output format, "jpg" or "png".
+        q10 (int): Quality scale 1–10 (higher is better quality / higher PNG compression).
+
+    Returns:
+        bytes: The encoded file.
+    """
+    if out_fmt == "jpg":
+        q = quality_maps("jpg", q10)
+        if _tj is not None:
+            return encode_jpeg_turbo(canvas, q)
+        buf = io.BytesIO()
+        Image.fromarray(canvas, "RGB").save(buf,
+                                            format="JPEG",
+                                            quality=q,
+                                            optimize=True,
+                                            progressive=True)
     else:
-        base = Image.new("RGB", (target, target), bg_rgb)
-        base.paste(img_resized, ((target - new_w)//2, (target - new_h)//2))
-    return base
+        comp = quality_maps("png", q10)
+        if deflate is not None:
+            try:
+                return encode_png_deflate(canvas, comp)
+            except Exception:
+                pass  # recurrimos a Pillow
+        # Para PNG, optimize True y compress_level
+        buf = io.BytesIO()
+        Image.fromarray(canvas, "RGB").save(buf,
+                                            format="PNG",
+                                            optimize=True,
+                                            compress_level=comp)
+    return buf.getvalue()
+
+def render_photo_vips(raw: bytes, target_w: int, bg_rgb: tuple, out_fmt: str, q10: int):
+    """Decode, square and encode one image with libvips.
+
+    pyvips.Image.thumbnail_buffer shrinks on load (the libvips counterpart of
+    Image.draft) and resizes with LANCZOS3 while streaming the image in
+    strips, so the full-resolution raster is never held in memory. Alpha is
+    flattened against bg_rgb and the result is centered with gravity(). As in
+    the Pillow path, EXIF orientation is not applied.
 
-def convert_photo(in_path: Path, out_path: Path, target_w: int, bg_hex: str,
-                  out_fmt: str, q10: int):
-    """Convert a single image to a squared image and save it.
+    Args:
+        raw (bytes): Contents of the input file.
+        target_w (int): Target square side in pixels.
+        bg_rgb (tuple[int, int, int]): Background RGB color.
+        out_fmt (str): Output format, "jpg" or "png".
+        q10 (int): Quality scale 1–10 (higher is better quality / higher PNG compression).
+
+    Returns:
+        bytes: The encoded file.
+    """
+    bg = list(bg_rgb)
+    # no_rotate: same orientation as the Pillow path, which ignores EXIF Orientation
+    image = pyvips.Image.thumbnail_buffer(raw, target_w, height=target_w, size="both", no_rotate=True)
+    image = image.colourspace("srgb")
+    if image.hasalpha():
+        image = image.flatten(background=bg)
+    image = image.gravity("centre", target_w, target_w, extend="background", background=bg)
+    # Sin metadatos: keep="none" desde libvips 8.15, strip=True en versiones anteriores
+    no_meta = {"keep": "none"} if pyvips.at_least_libvips(8, 15) else {"strip": True}
+    if out_fmt == "jpg":
+        # subsample_mode="on": con Q >= 90 libvips usaría 4:4:4 (~24% más grande)
+        return image.jpegsave_buffer(Q=quality_maps("jpg", q10), optimize_coding=True,
+                                     interlace=True, subsample_mode="on", **no_meta)
+    # filter="paeth": libvips no filtra las filas por defecto (PNG ~40% más grandes);
+    # compresión mínima 1, con 0 zlib guarda los datos sin comprimir
+    return image.pngsave_buffer(compression=max(1, quality_maps("png", q10)), filter="paeth", **no_meta)
+
+def render_photo(in_path: Path, raw: bytes, target_w: int, bg_rgb: tuple,
+                 out_fmt: str, q10: int, engine: str = "pil"):
+    """Decode, square and encode one image entirely in memory.
 
     Steps:
-    1) Load the image, 2) parse background color, 3) normalize mode depending
-    on output format, 4) pad to square at requested size, 5) save using mapped
-    quality/compression for JPG/PNG.
+    1) Decode the raw bytes (JPEG sources are decoded at a reduced DCT scale
+    when larger than the target), 2) normalize mode depending on output
+    format, 3) pad to square at requested size, 4) encode with encode_canvas.
+
+    No disk I/O happens here, so worker processes stay CPU-bound while the
+    parent reads inputs and writes outputs. Warnings are returned instead of
+    printed so that the parent process can report them.
 
     Args:
-        in_path (Path): Input image path.
-        out_path (Path): Output path WITHOUT extension; extension is added based on out_fmt.
+        in_path (Path): Input image path (used in messages only).
+        raw (bytes): Contents of the input file.
         target_w (int): Target square side in pixels.
-        bg_hex (str): Background color in hex without leading '#'.
+        bg_rgb (tuple[int, int, int]): Background RGB color (see parse_color).
         out_fmt (str): Output format, "jpg" or "png".
         q10 (int): Quality scale 1–10 (higher is better quality / higher PNG compression).
+        engine (str): Resize backend, "pil", "cv2" or "vips" (render_photo_vips;
+            falls back to Pillow for inputs libvips cannot load).
 
     Returns:
-        bool: True on success, False otherwise.
+        tuple[bytes | None, str | None]: Encoded output (None on failure) and
+        an optional warning message.
     """
+    if engine == "vips":
+        try:
+            return render_photo_vips(raw, target_w, bg_rgb, out_fmt, q10), None
+        except pyvips.Error:
+            engine = "pil"  # recurrimos a Pillow
+
     # Cargar
     try:
-        img = Image.open(in_path)
+        img = Image.open(io.BytesIO(raw))
+    except UnidentifiedImageError:
+        return None, f"[WARN] No se pudo abrir {in_path}: formato de imagen no reconocido"
     except Exception as e:
-        print(f"[WARN] No se pudo abrir {in_path}: {e}", file=sys.stderr)
-        return False
+        return None, f"[WARN] No se pudo abrir {in_path}: {e}"
 
-    # Color de fondo
-    try:
-        bg_rgb = ImageColor.getrgb("#" + bg_hex.strip().lstrip("#"))
-    except Exception:
-        print(f"[WARN] Color inválido {bg_hex}, usando blanco.", file=sys.stderr)
-        bg_rgb = (255, 255, 255)
+    # Para JPEG, decodificar ya reducido (escala DCT 1/2, 1/4, 1/8) sin que el
+    # lado largo baje de target_w
+    if img.format == "JPEG":
+        w, h = img.size
+        long_side = max(w, h)
+        if long_side > target_w:
+            img.draft("RGB", (-(-w * target_w // long_side), -(-h * target_w // long_side)))
 
     # Convertir a modo compatible con salida
-    if out_fmt == "jpg":
-        if img.mode in ("RGBA", "LA", "P"):
-            img = img.convert("RGBA")
-        else:
-            img = img.convert("RGB")
-    else:  # png
-        if img.mode == "P":
-            img = img.convert("RGBA")
+    try:
+        if out_fmt == "jpg":
+            # JPG no tiene alpha: aplanar contra el fondo ANTES de redimensionar,
+            # así el redimensionado trabaja con 3 canales en vez de 4
+            if img.mode == "P":
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+            if img.mode in ("RGBA", "LA"):
+                bg = Image.new("RGBA", img.size, bg_rgb + (255,))
+                img = Image.alpha_composite(bg, img.convert("RGBA")).convert("RGB")
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+        else:  # png
+            if img.mode == "P":
+                img = img.convert("RGBA")
+
+        # Redimensionar + cuadrar
+        canvas = get_padder(target_w, bg_rgb)(img, engine)
+    except Exception as e:
+        return None, f"[WARN] No se pudo procesar {in_path}: {e}"
 
-    # Redimensionar + cuadrar
-    canvas = pad_to_square(img, target_w, bg_rgb)
+    # La imagen original ya no se usa: liberar su buffer antes de codificar
+    img.close()
+    del img
 
-    # Guardar
-    ensure_dir(out_path.parent)
+    # Codificar
     try:
-        if out_fmt == "jpg":
-            q = quality_maps("jpg", q10)
-            canvas = canvas.convert("RGB")
-            canvas.save(out_path.with_suffix(".jpg"),
-                        format="JPEG",
-                        quality=q,
-                        optimize=True,
-                        progressive=True)
-        else:
-            comp = quality_maps("png", q10)
-            # Para PNG, optimize True y compress_level
-            canvas.save(out_path.with_suffix(".png"),
-                        format="PNG",
-                        optimize=True,
-                        compress_level=comp)
-        return True
+        return encode_canvas(canvas, out_fmt, q10), None
     except Exception as e:
-        print(f"[WARN] Error al guardar {out_path}: {e}", file=sys.stderr)
-        return False
+        return None, f"[WARN] Error al codificar {in_path}: {e}"
 
-def main():
-    """CLI entrypoint: walk source directory, filter, convert, and report.
+def write_output(path: Path, data: bytes):
+    """Write encoded bytes to path, creating parent directories as needed.
 
-    Uses parsed CLI options to collect eligible images, optionally recursing
-    subdirectories and optionally mirroring the destination structure. Each
-    selected image is converted via convert_photo.
+    Args:
+        path (Path): Output file path (with extension).
+        data (bytes): Encoded image.
+
+    Returns:
+        tuple[bool, str | None]: Success flag and an optional warning message.
     """
-    args = parse_args()
-    src_root = Path(args.source).expanduser().resolve()
-    dst_root = Path(args.destination).expanduser().resolve()
+    try:
+        ensure_dir(path.parent)
+        path.write_bytes(data)
+        return True, None
+    except Exception as e:
+        return False, f"[WARN] Error al guardar {path}: {e}"
 
-    if not src_root.exists():
-        print(f"[ERROR] Origen no existe: {src_root}", file=sys.stderr)
-        sys.exit(1)
+def convert_photo(in_path: Path, out_path: Path, target_w: int, bg_rgb: tuple,
+                  out_fmt: str, q10: int, engine: str = "pil"):
+    """Convert a single image to a squared image and save it.
 
-    # Preparar exclusiones
-    exclude_exts = [e.strip().lower().lstrip(".") for e in args.exclude_format.split(",") if e.strip()]
-    exclude_substrings = [s.strip().lower() for s in args.exclude_filenames.split(",") if s.strip()]
+    Reads in_path, runs render_photo and writes the result. main() runs the
+    same three stages as a pipeline instead.
 
-    total, ok = 0, 0
+    Args:
+        in_path (Path): Input image path.
+        out_path (Path): Output path WITHOUT extension; extension is added based on out_fmt.
+        target_w (int): Target square side in pixels.
+        bg_rgb (tuple[int, int, int]): Background RGB color (see parse_color).
+        out_fmt (str): Output format, "jpg" or "png".
+        q10 (int): Quality scale 1–10 (higher is better quality / higher PNG compression).
+        engine (str): Resize backend, "pil", "cv2" or "vips".
 
-    # Recolección de archivos
-    if args.recursive:
-        iterator = src_root.rglob("*")
-    else:
-        iterator = src_root.iterdir()
+    Returns:
+        tuple[bool, str | None]: Success flag and an optional warning message.
+    """
+    try:
+        raw = in_path.read_bytes()
+    except OSError as e:
+        return False, f"[WARN] No se pudo abrir {in_path}: {e}"
+    data, msg = render_photo(in_path, raw, target_w, bg_rgb, out_fmt, q10, engine)
+    if data is None:
+        return False, msg
+    return write_output(out_path.with_suffix("." + out_fmt), data)
+
+def gpu_square_jpegs(paths, target: int, bg_rgb: tuple, batch_size: int = 32):
+    """Decode, resize and pad JPEG files on the GPU with NVIDIA DALI.
+
+    nvJPEG decodes each batch on the device, fn.resize scales the long side
+    to target with LANCZOS3 and fn.crop centers the result on a target x
+    target canvas, padding with bg_rgb. Only the finished canvases are copied
+    back to host memory. EXIF orientation is not applied, as in the CPU paths.
+
+    A single undecodable JPEG makes DALI fail its whole batch; the files of
+    that batch are yielded with None (to be converted on the CPU) and the
+    pipeline is rebuilt from the next batch onward.
 
-    for item in iterator:
-        if not item.is_file():
-            continue
+    Args:
+        paths (list[Path]): JPEG files to process.
+        target (int): Target side length in pixels for the square canvas.
+        bg_rgb (tuple[int, int, int]): Background RGB color for the padding.
+        batch_size (int): Images per GPU batch.
+
+    Yields:
+        tuple[int, numpy.ndarray | None]: Index into paths and the
+        (target, target, 3) uint8 canvas, or None if its batch failed; in
+        input order. The next batch is only run once the previous one has been
+        fully consumed.
+    """
+    @pipeline_def(batch_size=batch_size, num_threads=4, device_id=0)
+    def square_pipeline(files):
+        jpegs, _ = fn.readers.file(files=files, name="Reader", pad_last_batch=True)
+        images = fn.decoders.image(jpegs, device="mixed", output_type=types.RGB,
+                                   adjust_orientation=False)
+        images = fn.resize(images, resize_longer=target, interp_type=types.INTERP_LANCZOS3, antialias=True)
+        return fn.crop(images, crop_h=target, crop_w=target,
+                       out_of_bounds_policy="pad", fill_values=list(bg_rgb))
+
+    offset = 0
+    while offset < len(paths):
+        pipe = square_pipeline([str(p) for p in paths[offset:]])
+        pipe.build()
+        for start in range(offset, len(paths), batch_size):
+            count = min(batch_size, len(paths) - start)
+            try:
+                canvases, = pipe.run()
+            except Exception:
+                # Lote fallido: sus archivos van a CPU y se reconstruye el pipeline
+                for i in range(count):
+                    yield start + i, None
+                offset = start + count
+                break
+            canvases = canvases.as_cpu()
+            for i in range(count):
+                yield start + i, np.asarray(canvases.at(i))
+        else:
+            offset = len(paths)
 
+def convert_photos_gpu(tasks, workers: int, batch_size: int = 32):
+    """Convert JPEG tasks with gpu_square_jpegs, encoding and writing on the CPU.
+
+    Encoding runs in a thread pool (the encoders release the GIL). At most
+    2 * workers canvases wait for an encoder, and every pending encode is
+    finished before the next GPU batch is requested, so host memory holds one
+    batch of canvases at a time. Tasks the GPU could not handle (a failed
+    batch, or the whole pipeline failing) are returned so the caller can run
+    them through convert_photos_cpu.
+
+    Args:
+        tasks (list[tuple]): (in_path, out_path, target_w, bg_rgb, out_fmt, q10, engine),
+            all with the same target_w and bg_rgb.
+        workers (int): Encoder threads.
+        batch_size (int): Images per GPU batch (see gpu_square_jpegs).
+
+    Returns:
+        tuple[int, list[tuple]]: Number of images written successfully and
+        the tasks left for the CPU.
+    """
+    def encode_and_write(task, arr):
+        in_path, out_path, _, _, out_fmt, q10, _ = task
+        try:
+            data = encode_canvas(arr, out_fmt, q10)
+        except Exception as e:
+            return False, f"[WARN] Error al codificar {in_path}: {e}"
+        return write_output(out_path.with_suffix("." + out_fmt), data)
+
+    ok = 0
+
+    def report(result):
+        nonlocal ok
+        success, msg = result
+        if msg:
+            print(msg, file=sys.stderr)
+        if success:
+            ok += 1
+
+    target_w, bg_rgb = tasks[0][2], tasks[0][3]
+    done, leftovers, futures = set(), [], deque()
+    with ThreadPoolExecutor(max_workers=workers) as enc:
+        try:
+            for i, arr in gpu_square_jpegs([t[0] for t in tasks], target_w, bg_rgb, batch_size):
+                done.add(i)
+                if arr is None:
+                    leftovers.append(tasks[i])
+                    continue
+                futures.append(enc.submit(encode_and_write, tasks[i], arr))
+                # Esperar si los codificadores se retrasan, y vaciar del todo
+                # antes de pedir el siguiente lote a la GPU
+                end_of_batch = (i + 1) % batch_size == 0
+                while futures and (end_of_batch or len(futures) >= 2 * workers):
+                    report(futures.popleft().result())
+        except Exception as e:
+            print(f"[WARN] Falló el pipeline CUDA ({e}); se continúa en CPU.", file=sys.stderr)
+            leftovers.extend(t for i, t in enumerate(tasks) if i not in done)
+        while futures:
+            report(futures.popleft().result())
+    return ok, leftovers
+
+def iter_tasks(src_root: Path, dst_root: Path, recursive: bool, mirror: bool,
+               exclude_exts, exclude_re, task_opts):
+    """Walk src_root lazily and yield one conversion task per eligible image.
+
+    Args:
+        src_root (Path): Source directory.
+        dst_root (Path): Destination directory.
+        recursive (bool): Descend into subdirectories.
+        mirror (bool): Mirror the source directory layout under dst_root.
+        exclude_exts (frozenset[str]): Extensions to skip (see should_skip).
+        exclude_re (re.Pattern | None): Excluded filename substrings (see should_skip).
+        task_opts (tuple): (target_w, bg_rgb, out_fmt, q10, engine), appended to each task.
+
+    Yields:
+        tuple: (in_path, out_path, target_w, bg_rgb, out_fmt, q10, engine).
+    """
+    for entry in _scan(str(src_root), recursive):
         # Detectar extensión de entrada
-        ext = item.suffix.lower().lstrip(".")
+        name_lower = entry.name.lower()
+        ext = os.path.splitext(name_lower)[1].lstrip(".")
         # Si no se excluye, seguimos
-        if should_skip(item, exclude_exts, exclude_substrings):
+        if should_skip(name_lower, ext, exclude_exts, exclude_re):
             continue
 
         # Solo procesamos formatos de imagen comunes que Pillow suele abrir
-        if ext not in ("jpg", "jpeg", "png", "tif", "tiff", "bmp", "webp", "heic"):
+        if ext not in ALLOWED_EXTS:
             continue
 
+        item = Path(entry.path)
+
         # Ruta de salida
-        if args.mirror_destination:
+        if mirror:
             rel = item.parent.relative_to(src_root)
             out_dir = dst_root.joinpath(rel)
         else:
             out_dir = dst_root
 
         out_base = out_dir.joinpath(item.stem)  # mismo nombre base
+        yield (item, out_base) + task_opts
 
-        total += 1
-        if convert_photo(
-            in_path=item,
-            out_path=out_base,
-            target_w=args.width,
-            bg_hex=args.output_color,
-            out_fmt=args.output_format.lower(),
-            q10=(args.output_quality or 10),
-        ):
-            ok += 1
+def read_inputs(tasks, out_q: queue.Queue):
+    """Reader stage: load input files and feed them to the conversion stage.
+
+    Puts (task, raw) pairs on out_q, where raw is the file contents or the
+    OSError raised while reading. If iterating tasks itself fails (the walk),
+    the exception is put on out_q so main() can report it. A final None marks
+    the end. The queue is bounded, so reading stays only a few files ahead of
+    the workers.
+
+    Args:
+        tasks (Iterable[tuple]): (in_path, out_path, target_w, bg_rgb, out_fmt, q10, engine).
+        out_q (queue.Queue): Bounded queue consumed by main().
+    """
+    try:
+        for task in tasks:
+            try:
+                raw = task[0].read_bytes()
+            except OSError as e:
+                raw = e
+            out_q.put((task, raw))
+    except Exception as e:
+        out_q.put(e)
+    finally:
+        out_q.put(None)
+
+def convert_photos_cpu(tasks, workers: int):
+    """Run tasks through the read -> render -> write pipeline.
+
+    A reader thread (read_inputs) consumes tasks lazily, a pool of worker
+    processes runs render_photo, and a small thread pool writes the encoded
+    outputs. At most 4 * workers conversions and 2 * workers writes are in
+    flight. Warnings are printed from this (the parent) process.
+
+    Args:
+        tasks (Iterable[tuple]): (in_path, out_path, target_w, bg_rgb, out_fmt, q10, engine);
+            may be a lazy generator such as the directory walk.
+        workers (int): Worker processes.
+
+    Returns:
+        tuple[int, int, Exception | None]: Tasks seen, images written
+        successfully, and the exception that interrupted iterating tasks, if any.
+    """
+    total, ok = 0, 0
+    walk_error = None
+    raw_q = queue.Queue(maxsize=2 * workers)
+    threading.Thread(target=read_inputs, args=(tasks, raw_q), daemon=True).start()
+
+    pending, writes = deque(), deque()
+    with ProcessPoolExecutor(max_workers=workers) as cpu, ThreadPoolExecutor(max_workers=2) as io_pool:
+        def finish_write(fut):
+            nonlocal ok
+            success, msg = fut.result()
+            if msg:
+                print(msg, file=sys.stderr)
+            if success:
+                ok += 1
+
+        def collect(task, fut):
+            data, msg = fut.result()
+            if msg:
+                print(msg, file=sys.stderr)
+            if data is not None:
+                out_file = task[1].with_suffix("." + task[4])
+                writes.append(io_pool.submit(write_output, out_file, data))
+            # Las escrituras ya terminadas se contabilizan sin esperar al final;
+            # si los escritores se retrasan, se espera (como mucho 2 * jobs en cola)
+            while writes and (writes[0].done() or len(writes) >= 2 * workers):
+                finish_write(writes.popleft())
+
+        while (item := raw_q.get()) is not None:
+            if isinstance(item, Exception):
+                walk_error = item
+                continue
+            total += 1
+            task, raw = item
+            if isinstance(raw, OSError):
+                print(f"[WARN] No se pudo abrir {task[0]}: {raw}", file=sys.stderr)
+                continue
+            pending.append((task, cpu.submit(render_photo, task[0], raw, *task[2:])))
+            # Contrapresión: como mucho 4 * jobs conversiones en vuelo
+            if len(pending) >= 4 * workers:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+        while writes:
+            finish_write(writes.popleft())
+    return total, ok, walk_error
+
+def parse_color(hex_color: str):
+    """Parse a hex color (with or without leading '#') into an RGB tuple.
+
+    Falls back to white, with a warning on stderr, if the value is invalid.
+
+    Args:
+        hex_color (str): Color in hex, e.g. "ffffff".
+
+    Returns:
+        tuple[int, int, int]: The RGB color.
+    """
+    try:
+        return ImageColor.getrgb("#" + hex_color.strip().lstrip("#"))[:3]
+    except Exception:
+        print(f"[WARN] Color inválido {hex_color}, usando blanco.", file=sys.stderr)
+        return (255, 255, 255)
+
+def main():
+    """CLI entrypoint: walk source directory, filter, convert, and report.
+
+    Uses parsed CLI options to collect eligible images, optionally recursing
+    subdirectories and optionally mirroring the destination structure. Each
+    selected image goes through convert_photos_cpu: a reader thread walks the
+    tree (iter_tasks) and loads files as they are found, a pool of worker
+    processes runs render_photo, and a small thread pool writes the encoded
+    outputs. Memory stays proportional to --jobs, not to the number of files.
+    With --device cuda, JPEG inputs go through convert_photos_gpu instead.
+    """
+    args = parse_args()
+    src_root = Path(args.source).expanduser().resolve()
+    dst_root = Path(args.destination).expanduser().resolve()
+
+    if args.engine == "cv2" and cv2 is None:
+        print("[ERROR] --engine cv2 requiere opencv-python instalado.", file=sys.stderr)
+        sys.exit(1)
+    if args.engine == "vips" and pyvips is None:
+        print("[ERROR] --engine vips requiere pyvips (libvips) instalado.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.device == "cuda" and pipeline_def is None:
+        print("[ERROR] --device cuda requiere NVIDIA DALI instalado.", file=sys.stderr)
+        sys.exit(1)
+
+    if not src_root.exists():
+        print(f"[ERROR] Origen no existe: {src_root}", file=sys.stderr)
+        sys.exit(1)
+
+    # Preparar exclusiones
+    exclude_exts = frozenset(e.strip().lower().lstrip(".") for e in args.exclude_format.split(",") if e.strip())
+    exclude_re = build_exclude_re([s.strip().lower() for s in args.exclude_filenames.split(",") if s.strip()])
+
+    # Color de fondo (una sola vez para todo el lote)
+    bg_rgb = parse_color(args.output_color)
+
+    task_opts = (args.width, bg_rgb, args.output_format.lower(), args.output_quality or 10, args.engine)
+    gpu_tasks = []
+
+    def cpu_tasks():
+        # Con --device cuda, los JPEG se apartan para la GPU; el resto sigue en CPU
+        for task in iter_tasks(src_root, dst_root, args.recursive, args.mirror_destination,
+                               exclude_exts, exclude_re, task_opts):
+            if args.device == "cuda" and task[0].suffix.lower() in (".jpg", ".jpeg"):
+                gpu_tasks.append(task)
+            else:
+                yield task
+
+    # Pipeline de CPU: el recorrido avanza a la vez que la conversión
+    workers = max(1, args.jobs)
+    total, ok, walk_error = convert_photos_cpu(cpu_tasks(), workers)
+
+    # Los JPEG de la GPU se procesan cuando termina el flujo de CPU: el lector
+    # de DALI necesita la lista completa de archivos, así que CPU y GPU no
+    # trabajan en paralelo
+    if gpu_tasks:
+        total += len(gpu_tasks)
+        gpu_ok, leftovers = convert_photos_gpu(gpu_tasks, workers)
+        ok += gpu_ok
+        if leftovers:
+            # Lotes que la GPU no pudo procesar: vuelven al pipeline de CPU
+            print(f"[WARN] {len(leftovers)} JPEG se procesan en CPU tras fallar en la GPU.", file=sys.stderr)
+            ok += convert_photos_cpu(leftovers, workers)[1]
 
     print(f"[DONE] Procesadas correctamente: {ok}/{total}")
+    if walk_error is not None:
+        print(f"[ERROR] Recorrido de {src_root} interrumpido: {walk_error}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()